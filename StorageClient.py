@@ -1,14 +1,60 @@
 import requests
-from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import asyncio
 import os
+import sys
+import mmap
+import shutil
+import tempfile
+import hashlib
 import mimetypes
 import glob
 from tqdm import trange
 from time import sleep
 
+# load the MIME database once at import instead of lazily on the first guess
+mimetypes.init()
+
+try:
+    # several times faster than stdlib json on the response payloads
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 class StorageClient:
-    def __init__(self, api_url:str=None):
+    CHUNK_SIZE = 1024*1024*20
+
+    def __init__(self, api_url:str=None, chunk_batch_size:int=1, http2:bool=False, use_async:bool=False, supports_directories:bool=True):
         self.api_url = api_url or "http://127.0.0.1:8000"
+        self._file_ep = self.api_url + '/file'
+        self._dir_ep = self.api_url + '/directory'
+        self._dl_ep = self.api_url + '/download'
+        # chunks sent per upload POST, >1 cuts round-trips if the backend accepts repeated file parts
+        self.chunk_batch_size = max(1, chunk_batch_size)
+        self._http2 = http2
+        # uploads chunks over aiohttp instead of the thread pool, needs the optional aiohttp package
+        self._use_async = use_async
+        # False for backends with a flat namespace (no directory endpoints)
+        self._supports_dirs = supports_directories
+        if http2:
+            # multiplexes all chunk transfers over one connection, needs the optional httpx[http2] package
+            import httpx
+            self._session = httpx.Client(http2=True, limits=httpx.Limits(max_connections=16, max_keepalive_connections=16), timeout=httpx.Timeout(60.0))
+        else:
+            self._session = requests.Session()
+            retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['POST', 'GET']))
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._session.headers.update({"Connection": "keep-alive"})
+
+    def _json(self, r) -> dict | list:
+        # fail loudly on HTTP errors instead of JSON-decoding an error page,
+        # and parse the already-buffered bytes without requests' encoding detection
+        r.raise_for_status()
+        return _json_loads(r.content)
 
     def add_file(self, file_name: str, file_size: int, file_mime_type: str, directory_path: str) -> dict:
         """
@@ -24,12 +70,12 @@ class StorageClient:
             "name": file_name,
             "mimeType": file_mime_type,
             "size": file_size,
-            "path": directory_path
         }
+        if self._supports_dirs:
+            data["path"] = directory_path
 
-        r = requests.post(self.api_url + '/file', data=data)
-        response = r.json()
-        return response
+        r = self._session.post(self._file_ep, data=data)
+        return self._json(r)
 
     def get_file_data(self, file_path: str) -> dict:
         """
@@ -43,23 +89,21 @@ class StorageClient:
         - fileName: The name of the file.
         - chunksIds: A list of the database IDs of the chunks.
         """
-        r = requests.get(self.api_url + '/file', params={
+        r = self._session.get(self._file_ep, params={
             "filePath": file_path
         })
 
-        response = r.json()
-        return response
+        return self._json(r)
     
     def get_current_directory_contents(self, directory_id: int=1) -> list:
         """
         Get current directory contents from the storage (defaults to root).
         """
-        r = requests.get(self.api_url, params={
+        r = self._session.get(self.api_url, params={
             "dirId": directory_id
         })
 
-        response = r.json()
-        return response
+        return self._json(r)
     
     def get_direcrory_data(self, directory_path: str=None) -> dict | list:
         """
@@ -68,15 +112,17 @@ class StorageClient:
         Parameters:
         - directory_path: The path of the directory to get the data of (optional).
         """
+        if not self._supports_dirs:
+            raise NotImplementedError("this backend has no directory support")
+
         if directory_path:
             params = {
                 "dirPath": directory_path
             }
         else: params = {}
 
-        r = requests.get(self.api_url + '/directory', params=params)
-        response = r.json()
-        return response
+        r = self._session.get(self._dir_ep, params=params)
+        return self._json(r)
 
     def make_new_directory(self, directory_path: str) -> dict:
         """
@@ -85,13 +131,15 @@ class StorageClient:
         Parameters:
         - directory_path: The path of the directory to create.
         """
+        if not self._supports_dirs:
+            raise NotImplementedError("this backend has no directory support")
+
         data = {
             "dirPath": directory_path
         }
 
-        r = requests.post(self.api_url + '/directory', params=data)
-        response = r.json()
-        return response
+        r = self._session.post(self._dir_ep, params=data)
+        return self._json(r)
 
     def split_file(self, input_file_path: str, chunk_size: int, output_directory: str) -> str | None:
         """
@@ -107,21 +155,54 @@ class StorageClient:
         """
 
         try:
-            with open(input_file_path, 'rb') as file:
-                if not Path.exists(Path(output_directory)): os.makedirs(output_directory)
-                file_name = os.path.basename(input_file_path)
-                
-                data = file.read(chunk_size)
-                chunk_number = 1
-
-                while data:
-                    chunk_filename = f"{output_directory}/{file_name}_{chunk_number}.bin"
-                    with open(chunk_filename, 'wb') as chunk_file:
-                        chunk_file.write(data)
-
-                    chunk_number += 1
-                    data = file.read(chunk_size)
-                return output_directory
+            os.makedirs(output_directory, exist_ok=True)
+            file_name = os.path.basename(input_file_path)
+            file_size = os.path.getsize(input_file_path)
+            chunk_prefix = f"{output_directory}/{file_name}_"
+
+            if sys.platform.startswith("linux"):
+                # copy in-kernel, no chunk-sized bytes object in userspace
+                # (only Linux sendfile accepts a regular file as destination)
+                in_fd = os.open(input_file_path, os.O_RDONLY)
+                try:
+                    if hasattr(os, "posix_fadvise"):
+                        # ask for aggressive readahead, the whole file is read front to back
+                        os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    offset = 0
+                    chunk_number = 1
+                    eof = False
+                    while offset < file_size and not eof:
+                        chunk_filename = chunk_prefix + str(chunk_number) + ".bin"
+                        out_fd = os.open(chunk_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+                        try:
+                            remaining = min(chunk_size, file_size - offset)
+                            while remaining > 0:
+                                sent = os.sendfile(out_fd, in_fd, offset, remaining)
+                                if sent == 0:
+                                    # the source shrank under us, stop splitting instead of spinning on empty chunks
+                                    eof = True
+                                    break
+                                offset += sent
+                                remaining -= sent
+                        finally:
+                            os.close(out_fd)
+                        chunk_number += 1
+                finally:
+                    os.close(in_fd)
+            else:
+                with open(input_file_path, 'rb') as file:
+                    chunk_number = 1
+                    while file.tell() < file_size:
+                        chunk_filename = chunk_prefix + str(chunk_number) + ".bin"
+                        with open(chunk_filename, 'wb') as chunk_file:
+                            remaining = min(chunk_size, file_size - file.tell())
+                            while remaining > 0:
+                                data = file.read(min(1024*1024, remaining))
+                                if not data: break
+                                chunk_file.write(data)
+                                remaining -= len(data)
+                        chunk_number += 1
+            return output_directory
         except Exception as e: return None
 
     def merge_chunks(self, chunks_directory: str, file_name: str) -> str:
@@ -136,16 +217,32 @@ class StorageClient:
         - output_file: The path to the output file.
         """
         try:
-            with open(file_name, 'wb') as output_file:
-                chunk_number = 1
-                chunk_filename = f"{chunks_directory}/{file_name}_{chunk_number}.bin"
-                while os.path.exists(chunk_filename):
-                    with open(chunk_filename, 'rb') as chunk_file:
-                        data = chunk_file.read()
-                        output_file.write(data)
+            prefix = file_name + "_"
+            with os.scandir(chunks_directory) as it:
+                entries = sorted((entry for entry in it if entry.name.startswith(prefix)), key=lambda entry: int(entry.name[len(prefix):].split(".")[0]))
 
-                    chunk_number += 1
-                    chunk_filename = f"{chunks_directory}/{file_name}_{chunk_number}.bin"
+            if not entries:
+                raise FileNotFoundError(f"no chunks matching {prefix}*.bin in {chunks_directory}")
+
+            with open(file_name, 'wb') as output_file:
+                out_fd = output_file.fileno()
+                for entry in entries:
+                    if sys.platform.startswith("linux"):
+                        # splice chunk -> output in-kernel, no chunk-sized bytes object
+                        # (only Linux sendfile accepts a regular file as destination)
+                        in_fd = os.open(entry.path, os.O_RDONLY)
+                        try:
+                            size = entry.stat().st_size
+                            offset = 0
+                            while offset < size:
+                                sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                                if sent == 0: break # truncated chunk, don't spin on EOF
+                                offset += sent
+                        finally:
+                            os.close(in_fd)
+                    else:
+                        with open(entry.path, 'rb') as chunk_file:
+                            shutil.copyfileobj(chunk_file, output_file, length=1024*1024)
             return file_name
         except Exception as e: return str(e)
     
@@ -169,6 +266,26 @@ class StorageClient:
         mime_type, encoding = mimetypes.guess_type(file_path)
         return mime_type
 
+    def _chunk_sha(self, chunk_path: str) -> str:
+        """
+        SHA-256 hex digest of a chunk file, sent so the server can verify the transfer.
+        """
+        with open(chunk_path, 'rb') as f:
+            if hasattr(hashlib, "file_digest"):
+                # OpenSSL's accelerated path, no Python-level read loop
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+
+            digest = hashlib.sha256()
+            for data in iter(lambda: f.read(1024*1024), b''):
+                digest.update(data)
+            return digest.hexdigest()
+
+    def _stat_file(self, file_path: str) -> tuple:
+        # one stat call for the size, the MIME guess only looks at the name
+        file_size = os.stat(file_path).st_size
+        mime_type, encoding = mimetypes.guess_type(file_path)
+        return file_size, mime_type
+
     def upload_file(self, file_local_path: str, directory_path: str="~") -> dict | None:
         """
         Upload a file to the storage.
@@ -177,48 +294,214 @@ class StorageClient:
         - file_local_path: The path to the file to upload.
         - directory_path: The path to the directory to upload the file to.
         """
-        file_size = self.get_file_size_in_bytes(file_local_path)
-        file_mime_type = self.get_mime_type(file_local_path)
+        file_size, file_mime_type = self._stat_file(file_local_path)
         file_name = os.path.basename(file_local_path)
         
-        file_data = self.add_file(file_name, file_size, file_mime_type, directory_path)
-        
+        try:
+            file_data = self.add_file(file_name, file_size, file_mime_type, directory_path)
+        except Exception as e:
+            print(e)
+            return None
+
         file_db_id = file_data.get("fileId", None)
         if file_db_id is None:
             print(file_data.get("error", None))
             return None
 
         print("File data sent successfully.")
-        chuncks_directory = self.split_file(file_local_path, 1024*1024*20, str(file_db_id))
-        
-        if chuncks_directory is None: 
-            print("Error splitting file.")
-            return None
-        
-        print("File chunks created successfully.")
-        if self.handle_uploading(chuncks_directory, file_db_id):
+        if file_size <= self.CHUNK_SIZE:
+            # fits in one chunk, POST the source file directly and skip the chunking machinery
+            try:
+                data = {
+                    "fileId": file_db_id,
+                    "sha256": self._chunk_sha(file_local_path),
+                }
+                with open(file_local_path, 'rb') as f:
+                    r = self._session.post(self.api_url, data=data, files={'file': (file_name + "_1.bin", f, file_mime_type)})
+                r.raise_for_status()
+                uploaded = True
+            except Exception: uploaded = False
+        else:
+            uploaded = self._upload_chunks(file_local_path, file_db_id)
+
+        if uploaded:
             print("File uploaded successfully.")
             return file_data
         else:
             print("Error uploading file.")
             return None
 
-    
-    def handle_uploading(self, chunks_dir_path: str, parent_file_id: int) -> bool:    
+
+    def _iter_chunks(self, file_path: str, chunk_size: int):
+        with open(file_path, 'rb') as file:
+            try:
+                mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # empty file (or no mmap support): fall back to plain reads
+                data = file.read(chunk_size)
+                while data:
+                    yield data
+                    data = file.read(chunk_size)
+                return
+
+            if hasattr(mmap, "MADV_SEQUENTIAL"): mm.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mm)
+            try:
+                for start in range(0, len(view), chunk_size):
+                    next_start = start + chunk_size
+                    if hasattr(mmap, "MADV_WILLNEED") and next_start < len(view) and next_start % mmap.PAGESIZE == 0:
+                        # ask the kernel to page in the next chunk while the workers send this one
+                        mm.madvise(mmap.MADV_WILLNEED, next_start, min(chunk_size, len(view) - next_start))
+                    yield view[start:start + chunk_size]
+            finally:
+                view.release()
+                try: mm.close()
+                except BufferError: pass # an in-flight upload still holds a slice, the map goes away when it drops
+
+    def _upload_chunks(self, file_local_path: str, parent_file_id: int) -> bool:
+        if self._use_async:
+            try:
+                asyncio.run(self._upload_chunks_async(file_local_path, parent_file_id))
+                return True
+            except Exception: return False
+
+        chunks_count = -(-self.get_file_size_in_bytes(file_local_path) // self.CHUNK_SIZE)
+        # same {file_name}_{n}.bin convention as split_file, the server echoes these names on download
+        chunk_prefix = os.path.basename(file_local_path) + "_"
+        t_range = trange(chunks_count, desc='Loading...', leave=True)
+        pending = {}
+        failed_batches = []
+        batch = []
+
+        def drain(done):
+            for future in done:
+                done_batch = pending.pop(future)
+                try:
+                    t_range.update(future.result())
+                except Exception:
+                    # keep the batch so one chunk's failure doesn't discard the others' progress
+                    failed_batches.append(done_batch)
+
+        executor = ThreadPoolExecutor(max_workers=8)
+        try:
+            for chunk_index, chunk in enumerate(self._iter_chunks(file_local_path, self.CHUNK_SIZE)):
+                t_range.set_description("Currently uploading (chunk %i)" % chunk_index)
+                t_range.refresh() # to show immediately the update
+                batch.append((chunk_prefix + str(chunk_index + 1) + ".bin", chunk))
+                if len(batch) < self.chunk_batch_size: continue
+
+                pending[executor.submit(self._post_chunks, batch, parent_file_id)] = batch
+                batch = []
+
+                # keep at most one batch per worker in flight so big files are never fully read into memory
+                if len(pending) >= 8:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    drain(done)
+
+            if batch:
+                pending[executor.submit(self._post_chunks, batch, parent_file_id)] = batch
+
+            done, _ = wait(pending)
+            drain(done)
+
+            # one resume pass over chunks whose POST exhausted the adapter's retries
+            for failed_batch in failed_batches:
+                t_range.update(self._post_chunks(failed_batch, parent_file_id))
+            executor.shutdown()
+            t_range.close()
+            return True
+        except Exception:
+            # drop the queued batches right away instead of letting the pool drain them
+            executor.shutdown(wait=False, cancel_futures=True)
+            t_range.close()
+            return False
+
+    async def _upload_chunks_async(self, file_local_path: str, parent_file_id: int) -> None:
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=4)
+        workers_count = 8
+
+        # same {file_name}_{n}.bin convention as split_file, the server echoes these names on download
+        chunk_prefix = os.path.basename(file_local_path) + "_"
+
+        async def read_chunks():
+            with open(file_local_path, 'rb') as file:
+                chunk_number = 1
+                while True:
+                    chunk = await loop.run_in_executor(None, file.read, self.CHUNK_SIZE)
+                    if not chunk: break
+                    await queue.put((chunk_prefix + str(chunk_number) + ".bin", chunk))
+                    chunk_number += 1
+            for _ in range(workers_count):
+                await queue.put(None)
+
+        async def send_chunks(session):
+            while True:
+                item = await queue.get()
+                if item is None: return
+                chunk_name, chunk = item
+                form = aiohttp.FormData()
+                form.add_field("fileId", str(parent_file_id))
+                form.add_field("sha256", hashlib.sha256(chunk).hexdigest())
+                form.add_field("file", chunk, filename=chunk_name, content_type="application/octet-stream")
+                async with session.post(self.api_url, data=form) as r:
+                    r.raise_for_status()
+                    await r.read()
+
+        connector = aiohttp.TCPConnector(limit=16, keepalive_timeout=75)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(read_chunks(), *[send_chunks(session) for _ in range(workers_count)])
+
+    def _post_chunks(self, named_chunks: list, parent_file_id: int) -> int:
+        # one digest per file part, in the same order, so the server can verify each chunk
+        digests = [hashlib.sha256(chunk_data).hexdigest() for chunk_name, chunk_data in named_chunks]
+
+        if self._http2:
+            # httpx's multipart encoder takes bytes or file-likes, not memoryviews,
+            # and repeated fields go in as a dict with a list value
+            named_chunks = [(chunk_name, bytes(chunk_data)) for chunk_name, chunk_data in named_chunks]
+            data = {
+                "fileId": parent_file_id,
+                "sha256": digests,
+            }
+        else:
+            data = [("fileId", parent_file_id)] + [("sha256", digest) for digest in digests]
+
+        files = [('file', (chunk_name, chunk_data, 'application/octet-stream')) for chunk_name, chunk_data in named_chunks]
+        r = self._session.post(self.api_url, data=data, files=files)
+        r.raise_for_status()
+        return len(named_chunks)
+
+    def handle_uploading(self, chunks_dir_path: str, parent_file_id: int) -> bool:
         chunks_list = glob.glob(f"{chunks_dir_path}/*")
+        executor = ThreadPoolExecutor(max_workers=8)
         try:
+            futures = [executor.submit(self._upload_one_chunk, chunk_path, parent_file_id) for chunk_path in chunks_list]
+
             t_range = trange(len(chunks_list), desc='Loading...', leave=True)
+            completed = as_completed(futures)
             for chunk_index in t_range:
                 t_range.set_description("Currently uploading (chunk %i)" % chunk_index)
                 t_range.refresh() # to show immediately the update
-                data = {
-                    "fileId": parent_file_id,
-                }
-
-                with open(chunks_list[chunk_index], 'rb') as f:
-                    r = requests.post(self.api_url, data=data, files={'file': f})   
+                next(completed).result()
+            executor.shutdown()
             return True
-        except Exception: return False 
+        except Exception:
+            # drop the queued chunks right away instead of letting the pool drain them
+            executor.shutdown(wait=False, cancel_futures=True)
+            return False
+
+    def _upload_one_chunk(self, chunk_path: str, parent_file_id: int) -> None:
+        data = {
+            "fileId": parent_file_id,
+            "sha256": self._chunk_sha(chunk_path),
+        }
+
+        with open(chunk_path, 'rb') as f:
+            r = self._session.post(self.api_url, data=data, files={'file': f})
+        r.raise_for_status()
 
     def download_file(self, file_path: str) -> str | None:
         """
@@ -231,23 +514,46 @@ class StorageClient:
         file_data = self.get_file_data(file_path)
         print("Currently downloading => ", file_name)
         chunks_id_list = file_data.get("chunksIds")
-        output_directory = file_name.split(".")[0]
-        if not Path.exists(Path(output_directory)): os.makedirs(output_directory)
-
-        t_range = trange(len(chunks_id_list), desc='Loading...', leave=True)
-        for chunk_data_index in t_range:
-            t_range.set_description("Currently downloading (chunk %i)" % chunk_data_index)
-            t_range.refresh() # to show immediately the update
-            chunk_id = chunks_id_list[chunk_data_index].get("chunkId")
-            chunk_name = chunks_id_list[chunk_data_index].get("chunkName")
-            r = requests.get(self.api_url + '/download', params={
-                "chunkId": chunk_id
-            })
-
-            with open(os.path.join(output_directory, chunk_name), "wb") as f:
-                f.write(r.content)
-
-        return self.merge_chunks(output_directory, file_name)
+
+        # scratch chunks are unlinked as soon as the merge is done
+        with tempfile.TemporaryDirectory(prefix=f"tg_dl_{file_name}_") as output_directory:
+            executor = ThreadPoolExecutor(max_workers=8)
+            try:
+                futures = [executor.submit(self._download_one_chunk, chunk_data, output_directory) for chunk_data in chunks_id_list]
+
+                t_range = trange(len(chunks_id_list), desc='Loading...', leave=True)
+                completed = as_completed(futures)
+                for chunk_data_index in t_range:
+                    t_range.set_description("Currently downloading (chunk %i)" % chunk_data_index)
+                    t_range.refresh() # to show immediately the update
+                    next(completed).result()
+                executor.shutdown()
+            except Exception:
+                # drop the queued chunks right away instead of letting the pool drain them
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+            return self.merge_chunks(output_directory, file_name)
+
+    def _download_one_chunk(self, chunk_data: dict, output_directory: str) -> None:
+        params = {
+            "chunkId": chunk_data.get("chunkId")
+        }
+        chunk_path = os.path.join(output_directory, chunk_data.get("chunkName"))
+
+        if self._http2:
+            with self._session.stream("GET", self._dl_ep, params=params) as r:
+                r.raise_for_status()
+                with open(chunk_path, "wb") as f:
+                    for buffer in r.iter_bytes(chunk_size=1024*1024):
+                        f.write(buffer)
+            return
+
+        r = self._session.get(self._dl_ep, params=params, stream=True)
+        r.raise_for_status()
+        with open(chunk_path, "wb") as f:
+            for buffer in r.iter_content(chunk_size=1024*1024):
+                f.write(buffer)
 
 
 